@@ -0,0 +1,26 @@
+"""
+Session HTTP partagée pour les assets Dagster.
+
+Une seule session requests (pool de connexions keep-alive + retries avec
+backoff) sert tous les appels GitHub du module : chaque appel après le
+premier réutilise la connexion TLS existante au lieu de repayer un
+handshake (~100ms).
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SESSION = requests.Session()
+
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+    ),
+)
+SESSION.mount('https://api.github.com/', _adapter)
+SESSION.mount('https://uploads.github.com/', _adapter)
@@ -10,38 +10,128 @@ Les assets sont des wrappers légers autour des fonctions métier,
 permettant une séparation claire entre orchestration et logique métier.
 """
 
-from dagster import asset, MaterializeResult, AssetExecutionContext, MetadataValue
-import time
+from dagster import (
+    asset,
+    BackfillPolicy,
+    MaterializeResult,
+    AssetExecutionContext,
+    MetadataValue,
+    StaticPartitionsDefinition,
+)
+import hashlib
+import json
+import mmap
 import requests
+from orchestration._http import SESSION
 import os
-from datetime import datetime
 from src.extract import extract_anilist_data
 from src.config import MAX_PAGES_TO_FETCH
 from src.compute_recommendations import compute_and_save_recommendations
 
+# Config GitHub résolue une seule fois à l'import (le .env est chargé par
+# src.config) : les secrets sont constants pour la durée du process, inutile
+# de relire l'environnement et de reconstruire headers/URLs à chaque run.
+_GH_TOKEN = os.getenv("GITHUB_TOKEN")
+_GH_REPO = os.getenv("GITHUB_REPO")
+_GH_TAG = os.getenv("GITHUB_RELEASE_TAG")
+_GH_HEADERS = {
+    "Authorization": f"token {_GH_TOKEN}",
+    "Accept": "application/vnd.github.v3+json",
+}
+_GH_RELEASE_URL = f"https://api.github.com/repos/{_GH_REPO}/releases/tags/{_GH_TAG}"
+
+# Cache local pour les réponses GitHub conditionnelles (ETag).
+# Une réponse 304 ne compte pas dans le rate limit GitHub et évite de
+# re-télécharger des métadonnées de release quasi immuables à chaque run.
+_GH_CACHE_DIR = ".dagster/cache"
+
+
+def _conditional_get(url: str, cache_key: str, headers: dict, logger=None) -> dict:
+    """
+    GET avec If-None-Match : renvoie le corps JSON, servi depuis le cache
+    disque local si GitHub répond 304 Not Modified.
+    """
+    cache_file = os.path.join(_GH_CACHE_DIR, f"{cache_key}.json")
+    cached = None
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass  # Pas de cache (premier run) ou cache corrompu : GET complet
+
+    request_headers = dict(headers)
+    if cached and cached.get("etag"):
+        request_headers["If-None-Match"] = cached["etag"]
+
+    r = SESSION.get(url, headers=request_headers)
+    if r.status_code == 304 and cached:
+        if logger:
+            logger.info(f"♻️ Réponse GitHub inchangée (304), cache utilisé pour '{cache_key}'")
+        return cached["body"]
+
+    r.raise_for_status()
+    body = r.json()
+    etag = r.headers.get("ETag")
+    if etag:
+        os.makedirs(_GH_CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({"etag": etag, "body": body}, f)
+    return body
+
+
+def _sha256_of_file(path: str) -> str:
+    """Calcule le SHA-256 d'un fichier par lectures de 1 MiB (RAM constante)."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Partitions par plage de 10 pages : un backfill matérialise les plages en
+# parallèle (multiprocess executor), divisant le temps de fetch d'autant.
+PAGES_PER_PARTITION = 10
+anilist_page_partitions = StaticPartitionsDefinition([
+    f"{i}-{min(i + PAGES_PER_PARTITION - 1, MAX_PAGES_TO_FETCH)}"
+    for i in range(1, MAX_PAGES_TO_FETCH + 1, PAGES_PER_PARTITION)
+])
+
 
 @asset(
     group_name="ingestion",
+    partitions_def=anilist_page_partitions,
+    # single_run : un backfill complet devient UN run couvrant toute la plage
+    # de partitions, au lieu de 50 runs avec leur overhead d'événements chacun.
+    backfill_policy=BackfillPolicy.single_run(),
     description="Extrait les données d'AniList et les charge dans Postgres (raw_anilist_json)"
 )
 def raw_anilist_data(context: AssetExecutionContext) -> MaterializeResult:
     """
     Asset représentant les données brutes AniList dans PostgreSQL.
-    
+
+    Partitionné par plage de pages AniList (ex: "11-20") : chaque partition
+    fetche sa plage indépendamment, ce qui permet à Dagster de paralléliser
+    un backfill complet.
+
     Cet asset est un simple wrapper autour de la fonction métier extract_anilist_data.
     La séparation permet de tester la logique métier indépendamment de Dagster.
     """
-    context.log.info("🚀 Démarrage de l'extraction AniList via Dagster...")
-    
+    # partition_key_range couvre aussi bien une partition seule qu'une plage
+    # complète quand un backfill single_run matérialise tout d'un coup.
+    key_range = context.partition_key_range
+    start_page = int(key_range.start.split("-")[0])
+    end_page = int(key_range.end.split("-")[1])
+    context.log.info(f"🚀 Démarrage de l'extraction AniList (pages {start_page}-{end_page}) via Dagster...")
+
     # Appeler la fonction métier avec le logger Dagster
     metadata = extract_anilist_data(
-        max_pages=MAX_PAGES_TO_FETCH,
-        delay_between_pages=2,
+        start_page=start_page,
+        end_page=end_page,
         logger=context.log
     )
-    
+
     context.log.info(f"✅ Extraction terminée : {metadata['num_records']} animes")
-    
+
     return MaterializeResult(metadata=metadata)
 
 
@@ -58,18 +148,13 @@ def anime_recommendations(context: AssetExecutionContext) -> MaterializeResult:
     La séparation permet de tester la logique métier indépendamment de Dagster.
     """
     context.log.info("🧮 Démarrage du calcul des recommandations...")
-    
-    start_time = time.time()
-    
-    # Appeler la fonction métier avec le logger Dagster
+
+    # La fonction métier mesure elle-même sa durée (perf_counter) et la
+    # renvoie dans ses métadonnées : pas de dict à muter ici.
     metadata = compute_and_save_recommendations(logger=context.log)
-    
-    # Ajouter le temps d'exécution
-    duration = time.time() - start_time
-    metadata["duration_seconds"] = round(duration, 2)
-    
-    context.log.info(f"✅ Recommandations générées en {duration:.2f}s")
-    
+
+    context.log.info(f"✅ Recommandations générées en {metadata['duration_seconds']:.2f}s")
+
     return MaterializeResult(metadata=metadata)
 
 @asset(
@@ -84,75 +169,104 @@ def deploy_recommendations(context) -> MaterializeResult:
     """
     context.log.info("🚀 Démarrage du déploiement vers GitHub Releases...")
 
-    # --- 1. Charger les secrets (depuis .env) ---
-    TOKEN = os.getenv("GITHUB_TOKEN")
-    REPO = os.getenv("GITHUB_REPO")
-    TAG = os.getenv("GITHUB_RELEASE_TAG")
+    # --- 1. Vérifier les secrets (résolus à l'import du module) ---
+    TAG = _GH_TAG
+    headers = _GH_HEADERS
     FILE_PATH = "data/recommendations.parquet"
     FILE_NAME = "recommendations.parquet"
 
-    if not all([TOKEN, REPO, TAG]):
+    if not all([_GH_TOKEN, _GH_REPO, _GH_TAG]):
         context.log.error("Secrets GITHUB_TOKEN, GITHUB_REPO, ou GITHUB_RELEASE_TAG manquants.")
         raise Exception("Variables d'environnement GitHub manquantes.")
 
-    headers = {
-        "Authorization": f"token {TOKEN}",
-        "Accept": "application/vnd.github.v3+json",
-    }
-
     # --- 2. Trouver l'URL d'upload pour cette Release ---
-    context.log.info(f"Recherche de la Release '{TAG}' sur '{REPO}'...")
-    release_url = f"https://api.github.com/repos/{REPO}/releases/tags/{TAG}"
-    
+    context.log.info(f"Recherche de la Release '{TAG}' sur '{_GH_REPO}'...")
+
     try:
-        r = requests.get(release_url, headers=headers)
-        r.raise_for_status()  # Lève une exception si erreur (404, 401...)
-        
-        release_data = r.json()
+        release_data = _conditional_get(
+            _GH_RELEASE_URL, f"gh_release_{TAG}", headers, logger=context.log
+        )
         upload_url_template = release_data["upload_url"]
-        release_id = release_data["id"]
+        # La réponse release-by-tag embarque déjà la liste des assets :
+        # inutile de refaire un GET /releases/{id}/assets (1 round-trip gagné).
+        release_assets = release_data.get("assets", [])
 
     except requests.exceptions.RequestException as e:
         context.log.error(f"Erreur: Release non trouvée (ou erreur API). {e}")
         raise
 
-    # --- 3. Supprimer l'ancien fichier (robustesse) ---
+    # --- 3. Court-circuit : fichier inchangé depuis le dernier déploiement ? ---
+    # Le SHA-256 du parquet est publié dans un petit asset sidecar ; si le hash
+    # local est identique, inutile de supprimer/réuploader des dizaines de Mo.
+    sha_name = f"{FILE_NAME}.sha256"
+    try:
+        local_sha = _sha256_of_file(FILE_PATH)
+    except FileNotFoundError:
+        context.log.error(f"Fichier local non trouvé : {FILE_PATH}. L'asset 'anime_recommendations' a-t-il bien tourné ?")
+        raise
+
+    remote_sha_asset = next((a for a in release_assets if a["name"] == sha_name), None)
+    if remote_sha_asset:
+        try:
+            r_sha = SESSION.get(remote_sha_asset["browser_download_url"], headers=headers)
+            r_sha.raise_for_status()
+            if r_sha.text.strip() == local_sha:
+                context.log.info("✅ Parquet identique à la release (SHA-256), upload sauté.")
+                return MaterializeResult(
+                    metadata={
+                        "status": "skipped_unchanged",
+                        "sha256": local_sha,
+                        "release_tag": TAG,
+                    }
+                )
+        except requests.exceptions.RequestException as e:
+            context.log.warning(f"Impossible de lire le SHA distant, on déploie quand même : {e}")
+
+    # --- 4. Supprimer les anciens fichiers (robustesse) ---
     context.log.info("Vérification des anciens artefacts...")
-    assets_url = f"https://api.github.com/repos/{REPO}/releases/{release_id}/assets"
-    
+
     try:
-        r_assets = requests.get(assets_url, headers=headers)
-        r_assets.raise_for_status()
-        
-        for asset_file in r_assets.json():
-            if asset_file["name"] == FILE_NAME:
-                context.log.warning(f"Suppression de l'ancien fichier '{FILE_NAME}'...")
-                requests.delete(asset_file["url"], headers=headers)
-                break
+        # NB : la suppression doit se terminer AVANT l'upload — GitHub refuse
+        # (422) un upload tant qu'un asset du même nom existe. Les deux appels
+        # ne sont donc pas parallélisables.
+        for asset_file in release_assets:
+            if asset_file["name"] in (FILE_NAME, sha_name):
+                context.log.warning(f"Suppression de l'ancien fichier '{asset_file['name']}'...")
+                r_delete = SESSION.delete(asset_file["url"], headers=headers)
+                r_delete.raise_for_status()
     except requests.exceptions.RequestException as e:
         context.log.error(f"Impossible de lister/supprimer les anciens assets : {e}")
         # On continue quand même, l'upload écrasera peut-être l'ancien
 
-    # --- 4. Uploader le nouveau fichier ---
-    upload_url = upload_url_template.split("{")[0] + f"?name={FILE_NAME}"
-    
+    # --- 5. Uploader le nouveau fichier + son SHA-256 sidecar ---
+    upload_base = upload_url_template.split("{")[0]
+    upload_url = upload_base + f"?name={FILE_NAME}"
+
     context.log.info(f"📤 Upload de '{FILE_PATH}' vers GitHub...")
-    
+
     try:
-        with open(FILE_PATH, 'rb') as f:
-            data = f.read()
-        
+        # Upload via mmap : le fichier est mappé en lecture seule et streamé
+        # depuis le page cache, sans jamais copier le parquet dans le heap
+        # Python. Un seul os.stat pour la taille.
         headers_upload = headers.copy()
-        headers_upload["Content-Type"] = "application/gzip"
-        
-        r_upload = requests.post(upload_url, headers=headers_upload, data=data)
+        headers_upload["Content-Type"] = "application/octet-stream"
+        headers_upload["Content-Length"] = str(os.stat(FILE_PATH).st_size)
+
+        with open(FILE_PATH, 'rb') as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            r_upload = SESSION.post(upload_url, headers=headers_upload, data=mm)
         r_upload.raise_for_status()
-        
+
         download_url = r_upload.json().get("browser_download_url", "N/A")
-    
-    except FileNotFoundError:
-        context.log.error(f"Fichier local non trouvé : {FILE_PATH}. L'asset 'anime_recommendations' a-t-il bien tourné ?")
-        raise
+
+        # Sidecar SHA-256 : permet au prochain déploiement de court-circuiter
+        r_sha_up = SESSION.post(
+            upload_base + f"?name={sha_name}",
+            headers={**headers, "Content-Type": "text/plain"},
+            data=local_sha.encode(),
+        )
+        r_sha_up.raise_for_status()
+
     except requests.exceptions.RequestException as e:
         context.log.error(f"Upload échoué: {e.response.json()}")
         raise
@@ -163,149 +277,7 @@ def deploy_recommendations(context) -> MaterializeResult:
         metadata={
             "status": "deployed_to_github_release",
             "download_url": MetadataValue.url(download_url),
+            "sha256": local_sha,
             "release_tag": TAG
         }
     )
-
-
-# @asset(
-#     group_name="deploy",
-#     description="Commit et push les recommandations vers GitHub",
-#     deps=[anime_recommendations]
-# )
-# def deploy_recommendations(context: AssetExecutionContext) -> MaterializeResult:
-#     """
-#     Commit et push le fichier recommendations.json vers GitHub.
-    
-#     ATTENTION: Cet asset nécessite:
-#     - Git configuré avec des credentials valides
-#     - Droits d'écriture sur le repository
-#     - Être sur une branche appropriée (main, production, etc.)
-    
-#     Sécurités intégrées:
-#     - Vérification de la branche (ne push pas depuis feature branches)
-#     - Détection des changements (skip si aucun changement)
-#     - Gestion d'erreur complète
-#     """
-#     json_path = "data/recommendations.json"
-    
-#     def run_git_cmd(cmd_list: list, error_msg: str) -> str:
-#         """Exécute une commande git et retourne le résultat."""
-#         result = subprocess.run(
-#             cmd_list, 
-#             capture_output=True, 
-#             text=True,
-#             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Root du projet
-#         )
-#         if result.returncode != 0:
-#             context.log.error(f"{error_msg}: {result.stderr}")
-#             raise Exception(f"{error_msg}: {result.stderr}")
-        
-#         output = result.stdout.strip()
-#         if output:
-#             context.log.info(f"  └─ {output}")
-#         return output
-
-#     context.log.info("🚀 Démarrage du déploiement Git...")
-
-#     try:
-#         # 1. Vérifier la branche actuelle
-#         current_branch = run_git_cmd(
-#             ["git", "branch", "--show-current"], 
-#             "Erreur lors de la vérification de la branche"
-#         )
-#         context.log.info(f"📌 Branche actuelle : {current_branch}")
-        
-#         # SÉCURITÉ : Ne push que sur des branches autorisées
-#         allowed_branches = ["main", "production", "deploy"]
-#         if current_branch not in allowed_branches:
-#             context.log.warning(
-#                 f"⚠️ Déploiement désactivé sur la branche '{current_branch}'. "
-#                 f"Branches autorisées : {', '.join(allowed_branches)}"
-#             )
-#             return MaterializeResult(
-#                 metadata={
-#                     "status": "skipped_wrong_branch",
-#                     "current_branch": current_branch,
-#                     "allowed_branches": allowed_branches,
-#                     "message": "Déploiement désactivé : branche non-production"
-#                 }
-#             )
-
-#         # 2. Vérifier si le fichier existe
-#         if not os.path.exists(json_path):
-#             context.log.error(f"❌ Fichier introuvable : {json_path}")
-#             return MaterializeResult(
-#                 metadata={
-#                     "status": "error_file_not_found",
-#                     "file": json_path
-#                 }
-#             )
-
-#         # 3. Vérifier la taille du fichier
-#         file_size_mb = os.path.getsize(json_path) / (1024 * 1024)
-#         context.log.info(f"📦 Taille du fichier : {file_size_mb:.2f} MB")
-        
-#         if file_size_mb > 100:  # GitHub a une limite de 100MB
-#             context.log.error(f"❌ Fichier trop volumineux : {file_size_mb:.2f} MB (max: 100 MB)")
-#             return MaterializeResult(
-#                 metadata={
-#                     "status": "error_file_too_large",
-#                     "file_size_mb": round(file_size_mb, 2)
-#                 }
-#             )
-
-#         # 4. Ajouter le fichier au staging
-#         context.log.info("📝 Ajout du fichier au staging...")
-#         run_git_cmd(["git", "add", json_path], "Erreur git add")
-
-#         # 5. Vérifier s'il y a des changements
-#         status = subprocess.run(
-#             ["git", "status", "--porcelain", json_path], 
-#             capture_output=True, 
-#             text=True
-#         )
-        
-#         if not status.stdout.strip():
-#             context.log.info("🛑 Aucun changement détecté. Pas de push nécessaire.")
-#             return MaterializeResult(
-#                 metadata={
-#                     "status": "skipped_no_changes",
-#                     "branch": current_branch,
-#                     "file_size_mb": round(file_size_mb, 2)
-#                 }
-#             )
-
-#         # 6. Commit avec message descriptif
-#         commit_msg = f"data: update recommendations {datetime.now().strftime('%Y-%m-%d %H:%M')} [skip ci]"
-#         context.log.info(f"💾 Commit : {commit_msg}")
-#         run_git_cmd(["git", "commit", "-m", commit_msg], "Erreur git commit")
-
-#         # 7. Push vers GitHub
-#         context.log.info(f"🚢 Push vers origin/{current_branch}...")
-#         push_output = run_git_cmd(
-#             ["git", "push", "origin", current_branch], 
-#             "Erreur git push"
-#         )
-
-#         context.log.info("🎉 Déploiement réussi ! Les changements sont maintenant sur GitHub.")
-        
-#         return MaterializeResult(
-#             metadata={
-#                 "status": "deployed",
-#                 "branch": current_branch,
-#                 "file_size_mb": round(file_size_mb, 2),
-#                 "commit_message": commit_msg,
-#                 "timestamp": datetime.now().isoformat()
-#             }
-#         )
-
-#     except Exception as e:
-#         context.log.error(f"❌ Erreur lors du déploiement : {e}")
-#         return MaterializeResult(
-#             metadata={
-#                 "status": "failed",
-#                 "error": str(e),
-#                 "timestamp": datetime.now().isoformat()
-#             }
-#         )
\ No newline at end of file
@@ -6,7 +6,16 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
 
-from dagster import Definitions, load_assets_from_modules, define_asset_job, ScheduleDefinition
+from dagster import (
+    AssetSelection,
+    Definitions,
+    load_assets_from_modules,
+    define_asset_job,
+    multiprocess_executor,
+    RunRequest,
+    schedule,
+    ScheduleDefinition,
+)
 import logging
 
 # On importe nos assets
@@ -15,9 +24,34 @@ from orchestration import assets
 # On charge tous les assets définis dans le module assets.py
 all_assets = load_assets_from_modules([assets])
 
-# On définit le Job : "Mettre à jour toute la plateforme"
-# selection="*" signifie "prends tous les assets disponibles"
-update_all_job = define_asset_job(name="update_anime_platform", selection="*")
+# Job d'extraction : partitionné par plage de pages AniList. Un backfill de
+# toutes les partitions fetche les plages en parallèle (multiprocess executor).
+extract_anilist_job = define_asset_job(
+    name="extract_anilist_pages",
+    selection=AssetSelection.keys("raw_anilist_data"),
+)
+
+# Job "Mettre à jour la plateforme" : recalcul ML + déploiement.
+# (raw_anilist_data est partitionné, il a donc son propre job ci-dessus.)
+update_all_job = define_asset_job(
+    name="update_anime_platform",
+    selection=AssetSelection.keys("anime_recommendations", "deploy_recommendations"),
+)
+
+# Schedule d'extraction : rafraîchit les données brutes AniList chaque
+# dimanche à 02:00, une heure avant le recalcul ML, pour que les
+# recommandations ne tournent jamais sur des données figées. Une RunRequest
+# par plage de pages : les partitions tournent en parallèle.
+@schedule(
+    job=extract_anilist_job,
+    cron_schedule="0 2 * * 0",  # Dimanche à 02:00
+)
+def weekly_extract_schedule(context):
+    stamp = context.scheduled_execution_time.strftime("%Y-%m-%d")
+    return [
+        RunRequest(run_key=f"{stamp}_{partition_key}", partition_key=partition_key)
+        for partition_key in assets.anilist_page_partitions.get_partition_keys()
+    ]
 
 # On définit le Schedule : "Lance ce job tous les dimanches à 3h du mat"
 # cron_schedule="0 3 * * 0" est la syntaxe standard CRON (Minute Heure JourMois Mois JourSemaine)
@@ -50,6 +84,9 @@ configure_logging()
 
 defs = Definitions(
     assets=all_assets,
-    jobs=[update_all_job],
-    schedules=[weekly_update_schedule]
+    jobs=[extract_anilist_job, update_all_job],
+    schedules=[weekly_extract_schedule, weekly_update_schedule],
+    # Exécuteur multiprocess : les branches d'assets indépendantes d'un même
+    # run peuvent tourner en parallèle au lieu d'être sérialisées in-process.
+    executor=multiprocess_executor.configured({"max_concurrent": os.cpu_count() or 4}),
     )
\ No newline at end of file
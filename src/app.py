@@ -1,13 +1,11 @@
 # src/app.py - Page d'accueil de la plateforme Anime Data
+# Imports lourds (sqlalchemy, pyarrow, requests) différés dans les fonctions :
+# le premier paint de la page d'accueil ne paie que Streamlit + config.
+# Le .env est déjà chargé par l'import de config (load_env_once).
 import streamlit as st
 from pathlib import Path
 from config import logger
-import pandas as pd
 import os
-import sqlalchemy
-from dotenv import load_dotenv
-
-load_dotenv()
 
 # --- CONFIG ---
 logger.info("🏠 Chargement de la page d'accueil")
@@ -18,11 +16,14 @@ st.set_page_config(
 )
 
 # --- LOAD CSS ---
+@st.cache_resource
+def _read_css(file_name):
+    """Lit un fichier CSS une seule fois (Streamlit rerun à chaque interaction)."""
+    return (Path(__file__).parent / "styles" / file_name).read_text()
+
 def load_css(file_name):
-    """Charge un fichier CSS externe."""
-    css_file = Path(__file__).parent / "styles" / file_name
-    with open(css_file) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    """Injecte un fichier CSS externe (contenu mis en cache)."""
+    st.markdown(f"<style>{_read_css(file_name)}</style>", unsafe_allow_html=True)
 
 load_css("global_styles.css")
 load_css("home_styles.css")
@@ -30,30 +31,61 @@ load_css("home_styles.css")
 # L'URL publique de notre fichier Parquet
 PARQUET_URL = "https://github.com/YasserMourabih/anime-data-platform/releases/download/v1.0.0-data/recommendations.parquet"
 
+@st.cache_resource
+def get_db_engine():
+    """
+    Engine SQLAlchemy partagé entre les reruns Streamlit (cache_resource) :
+    le handshake TLS vers Neon n'est payé qu'une fois, les reruns réutilisent
+    une connexion chaude du pool.
+    """
+    import sqlalchemy
+    db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?sslmode=require"
+    return sqlalchemy.create_engine(
+        db_url,
+        pool_size=2,
+        pool_pre_ping=True,   # Vérifie la connexion avant usage (Neon coupe les idle)
+        pool_recycle=1800,
+    )
+
 # --- LOAD STATS ---
 @st.cache_data(ttl=3600)  # Cache 1 heure
 def load_platform_stats():
     """Charge les statistiques dynamiques de la plateforme."""
+    import sqlalchemy
     stats = {}
     try:
         # --- 1. Stats depuis la BDD (Neon) ---
-        # Cette partie était parfaite et ne change pas
-        db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?sslmode=require"
-        engine = sqlalchemy.create_engine(db_url)
-        
+        # COUNT scalaire direct : pas de DataFrame à construire pour un entier
         query_animes = "SELECT COUNT(*) as total FROM view_anime_basic WHERE score > 60"
-        df_count = pd.read_sql(query_animes, engine)
-        total_animes = int(df_count['total'].iloc[0])
+        with get_db_engine().connect() as conn:
+            total_animes = int(conn.execute(sqlalchemy.text(query_animes)).scalar())
         stats['total_animes'] = f"{total_animes:,}"
         
         # --- 2. Stats depuis le Parquet (Cloud) ---
-        # On lit directement depuis l'URL, plus besoin de os.path.exists
+        # On ne lit que le footer Parquet (metadata.num_rows) via une requête
+        # Range avec requests (déjà dans requirements.txt) : quelques KB
+        # transférés au lieu du fichier entier, juste pour un compte de lignes.
         import time
-        start = time.time()
-        df_recos = pd.read_parquet(PARQUET_URL)
-        load_time = (time.time() - start) * 1000  # en ms
-
-        total_recos = len(df_recos)
+        import requests
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        start = time.perf_counter()
+        r = requests.get(PARQUET_URL, headers={'Range': 'bytes=-65536'}, timeout=15)
+        r.raise_for_status()
+        tail = r.content
+        # Fin du fichier Parquet : [métadonnées][taille sur 4 octets]["PAR1"]
+        footer_len = int.from_bytes(tail[-8:-4], 'little')
+        if footer_len + 8 > len(tail):
+            # Métadonnées plus grosses que les 64 KB : re-fetch de la fin exacte
+            r = requests.get(
+                PARQUET_URL, headers={'Range': f'bytes=-{footer_len + 8}'}, timeout=15
+            )
+            r.raise_for_status()
+            tail = r.content
+        total_recos = pq.read_metadata(
+            pa.BufferReader(b'PAR1' + tail[-(footer_len + 8):])
+        ).num_rows
+        load_time = (time.perf_counter() - start) * 1000  # en ms
         stats['total_recos'] = f"{total_recos:,}"
         stats['load_time'] = f"{load_time:.0f}ms" if load_time < 1000 else f"{load_time/1000:.2f}s"
         
@@ -15,44 +15,72 @@ Cette fonction peut être appelée :
 - Depuis un notebook (sans logger)
 """
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 import re
+import time
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import linear_kernel
 from scipy.sparse import hstack  # Combinaison pondérée des matrices
-from dotenv import load_dotenv
 import sqlalchemy
 from dagster import MetadataValue
+from src.config import load_env_once
 
-load_dotenv()
+load_env_once()
 
 # 🎛️ Paramètres de pondération
 WEIGHT_META = 0.7  # 70% du poids pour les tags/genres (signal fiable)
 WEIGHT_DESC = 0.3  # 30% du poids pour le synopsis (bonus contexte)
 
+# Variations de titre à supprimer (séquelles, saisons, films, OVA, etc.),
+# compilées une seule fois en une alternation unique. L'alternation est
+# ré-appliquée jusqu'au point fixe (1-2 itérations en pratique) : retirer un
+# suffixe peut en exposer un autre ("show 2 (tv)" → "show 2" → "show"),
+# comme le faisait la cascade de re.sub d'origine.
+_FRANCHISE_RE = re.compile(
+    r'(?:'
+    r'\s*:\s*.*'                        # Tout après les deux-points ("Naruto: Shippuden" → "Naruto")
+    r'|\s+season\s+\d+.*'               # Season + numéro
+    r'|\s+\d+(?:st|nd|rd|th)\s+season.*'
+    r'|\s+part\s+\d+.*'                 # Part + numéro
+    r'|\s+movie.*'                      # Movie
+    r'|\s+film.*'                       # Film
+    r'|\s+ova.*'                        # OVA
+    r'|\s+ona.*'                        # ONA
+    r'|\s+special.*'                    # Special
+    r'|\s+recap.*'                      # Recap
+    r'|\s+\(.*\)$'                      # Tout entre parenthèses à la fin
+    r'|\s+\d+$'                         # Numéro seul à la fin ("Naruto 2")
+    r'|\s+ii$'                          # Chiffres romains
+    r'|\s+iii$'
+    r'|\s+iv$'
+    r'|\s+v$'
+    r')',
+    re.IGNORECASE,
+)
+_WS_RE = re.compile(r'\s+')
 
-def clean_html(raw_html):
-    """
-    Nettoie les balises HTML d'une chaîne de caractères.
-    
-    Args:
-        raw_html: Texte potentiellement avec des balises HTML
-        
-    Returns:
-        str: Texte nettoyé sans balises HTML
-    """
-    if not raw_html:
-        return ''
-    
-    # Supprimer les balises HTML
-    cleanr = re.compile('<.*?>')
-    text = re.sub(cleanr, '', raw_html)
-    
-    # Nettoyer les espaces multiples
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+# Engine SQLAlchemy partagé (créé paresseusement, même patron que la session
+# HTTP d'extract.py) : sous le schedule Dagster, les runs successifs du même
+# process réutilisent le pool au lieu de repayer le handshake TLS vers Neon.
+_engine = None
+
+def get_engine():
+    """Retourne l'engine SQLAlchemy partagé (créé paresseusement)."""
+    global _engine
+    if _engine is None:
+        db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?sslmode=require"
+        _engine = sqlalchemy.create_engine(
+            db_url,
+            pool_size=5,
+            max_overflow=5,
+            pool_pre_ping=True,  # Vérifie la connexion avant usage (Neon coupe les idle)
+            pool_recycle=1800,
+        )
+    return _engine
 
 
 def extract_franchise_name(title):
@@ -77,34 +105,16 @@ def extract_franchise_name(title):
         return ''
     
     title_lower = title.lower()
-    
-    # Patterns à supprimer (séquelles, saisons, films, OVA, etc.)
-    patterns_to_remove = [
-        r'\s*:\s*.*',           # Tout après les deux-points (ex: "Naruto: Shippuden" → "Naruto")
-        r'\s+season\s+\d+.*',   # Season + numéro
-        r'\s+\d+(st|nd|rd|th)\s+season.*',
-        r'\s+part\s+\d+.*',     # Part + numéro
-        r'\s+movie.*',          # Movie
-        r'\s+film.*',           # Film
-        r'\s+ova.*',            # OVA
-        r'\s+ona.*',            # ONA
-        r'\s+special.*',        # Special
-        r'\s+recap.*',          # Recap
-        r'\s+\(.*\)$',          # Tout entre parenthèses à la fin
-        r'\s+\d+$',             # Numéro seul à la fin (ex: "Naruto 2")
-        r'\s+ii$',              # Chiffres romains
-        r'\s+iii$',
-        r'\s+iv$',
-        r'\s+v$',
-    ]
-    
-    # Appliquer tous les patterns
+
+    # Supprimer les variations (alternation pré-compilée, appliquée jusqu'au
+    # point fixe) puis nettoyer les espaces multiples et trim
     franchise_name = title_lower
-    for pattern in patterns_to_remove:
-        franchise_name = re.sub(pattern, '', franchise_name, flags=re.IGNORECASE)
-    
-    # Nettoyer les espaces multiples et trim
-    franchise_name = re.sub(r'\s+', ' ', franchise_name).strip()
+    while True:
+        stripped = _FRANCHISE_RE.sub('', franchise_name)
+        if stripped == franchise_name:
+            break
+        franchise_name = stripped
+    franchise_name = _WS_RE.sub(' ', franchise_name).strip()
     
     # Si c'est trop court après nettoyage, garder au moins 3 premiers mots
     if len(franchise_name) < 3 and title_lower:
@@ -143,73 +153,77 @@ def compute_and_save_recommendations(
         else:
             print(msg)
     
-    # 1. Connexion à la base de données
+    # perf_counter : horloge monotone, la bonne référence pour mesurer une durée
+    t0 = time.perf_counter()
+
+    # 1. Connexion à la base de données (engine poolé partagé)
     log("📊 Connexion à la base de données...")
-    db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?sslmode=require"
-    engine = sqlalchemy.create_engine(db_url)
-    
-    # 2. Chargement des données
-    log("⏳ Chargement des données depuis PostgreSQL...")
-    df_anime = pd.read_sql("""
-                           SELECT anime_id, title, description, score
-                           FROM view_anime_basic 
-                           WHERE score > 60 AND popularity is NOT NULL 
-                           ORDER BY popularity DESC
-                           LIMIT 5000
-                           """, engine)
-    df_genres = pd.read_sql("SELECT anime_id, genre FROM view_anime_genres", engine)
-    df_tags = pd.read_sql("SELECT anime_id, tag FROM view_anime_tags", engine)
-    
-    log(f"✅ {len(df_anime)} animes, {len(df_genres)} genres, {len(df_tags)} tags chargés")
-    
-    # 2a. Filtrage des animes avec score > 60 (AniList utilise une échelle de 0-100)
-    log("🎯 Filtrage des animes avec score > 60...")
-    df_anime_before = len(df_anime)
-    df_anime = df_anime[df_anime['score'] > 60]
-    log(f"   └─ {len(df_anime)}/{df_anime_before} animes conservés (score > 60)")
-    
-    # Filtrer aussi les genres/tags pour ne garder que ceux des animes conservés
-    anime_ids_kept = set(df_anime['anime_id'].unique())
-    df_genres = df_genres[df_genres['anime_id'].isin(anime_ids_kept)]
-    df_tags = df_tags[df_tags['anime_id'].isin(anime_ids_kept)]
-    
+    engine = get_engine()
+    
+    # 2. Chargement des données : une seule requête, l'agrégation genres+tags
+    # se fait côté Postgres (string_agg en C). Trois rapatriements réseau et
+    # le pipeline concat/groupby/merge pandas disparaissent ; le WHERE côté
+    # serveur rend aussi tout re-filtrage local inutile.
+    log("⏳ Chargement des données depuis PostgreSQL (agrégation côté serveur)...")
+    df_final = pd.read_sql("""
+        SELECT a.anime_id,
+               a.title,
+               a.description,
+               a.score,
+               COALESCE(g.genres, '') || ' ' || COALESCE(t.tags, '') AS soup_meta
+        FROM view_anime_basic a
+        LEFT JOIN (
+            SELECT anime_id, string_agg(genre, ' ') AS genres
+            FROM view_anime_genres
+            GROUP BY anime_id
+        ) g USING (anime_id)
+        LEFT JOIN (
+            SELECT anime_id, string_agg(tag, ' ') AS tags
+            FROM view_anime_tags
+            GROUP BY anime_id
+        ) t USING (anime_id)
+        WHERE a.score > 60 AND a.popularity IS NOT NULL
+        ORDER BY a.popularity DESC
+        LIMIT 5000
+    """, engine, dtype_backend='pyarrow')  # Chaînes en Arrow : plus compactes que l'object dtype
+
+    log(f"✅ {len(df_final)} animes chargés (soupe méta agrégée par Postgres)")
+
     # 2b. Nettoyage des synopsis (suppression des balises HTML)
+    # Vectorisé via l'accesseur .str : le regex compilé passe sur toute la
+    # Series en C, au lieu d'un appel Python clean_html par ligne.
     log("🧹 Nettoyage des synopsis...")
-    df_anime['description'] = df_anime['description'].apply(clean_html)
-    df_anime['description'] = df_anime['description'].fillna('')  # Remplacer NULL par chaîne vide
-    
-    # 3. Préparation des "soupes" SÉPARÉES (nouveau!)
-    log("🍳 Préparation des soupes SÉPARÉES (meta vs synopsis)...")
-    
-    # Soupe 1: Métadonnées (genres + tags)
-    df_features_meta = pd.concat([
-        df_genres.rename(columns={'genre': 'feature_value'})[['anime_id', 'feature_value']],
-        df_tags.rename(columns={'tag': 'feature_value'})[['anime_id', 'feature_value']]
-    ], ignore_index=True)
-    
-    soup_meta = df_features_meta.groupby('anime_id')['feature_value'].apply(
-        lambda x: ' '.join(x.astype(str))
-    ).reset_index()
-    soup_meta.columns = ['anime_id', 'soup_meta']
-    
-    # 4. Fusionner tout dans un DataFrame final
-    df_final = pd.merge(df_anime, soup_meta, on='anime_id', how='left')
-    df_final['soup_meta'] = df_final['soup_meta'].fillna('')
+    df_final['description'] = (
+        df_final['description']
+        .fillna('')  # Remplacer NULL par chaîne vide
+        .str.replace(r'<[^>]*>', '', regex=True)  # [^>]* : pas de backtracking, contrairement à .*?
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
     
     # 5. Vectorisation SÉPARÉE avec pondération
     log(f"🧮 Vectorisation séparée (Meta: {WEIGHT_META*100:.0f}%, Synopsis: {WEIGHT_DESC*100:.0f}%)...")
     
+    # dtype float32 : moitié moins d'octets par valeur TF-IDF, et le produit
+    # de similarité double son débit AVX (deux fois plus de lanes qu'en
+    # float64) pour des scores rendus à 3 décimales de toute façon.
     # Vectorizer 1: Métadonnées (genres + tags) - Simple, pas de ngrams
-    tfidf_meta = TfidfVectorizer(stop_words='english', min_df=5)
+    # La soupe méta est déjà une liste de tokens séparés par des espaces
+    # (string_agg) : str.split suffit, pas besoin du tokenizer regex sklearn
+    tfidf_meta = TfidfVectorizer(
+        stop_words='english', min_df=5, dtype=np.float32,
+        tokenizer=str.split, token_pattern=None
+    )
     tfidf_matrix_meta = tfidf_meta.fit_transform(df_final['soup_meta'])
-    
+
     # Vectorizer 2: Synopsis - Plus complexe avec ngrams
     tfidf_desc = TfidfVectorizer(
         stop_words='english',
         ngram_range=(1, 2),
         min_df=10,
         max_df=0.5,
-        max_features=500
+        max_features=500,
+        dtype=np.float32
     )
     tfidf_matrix_desc = tfidf_desc.fit_transform(df_final['description'])
     
@@ -223,90 +237,159 @@ def compute_and_save_recommendations(
         tfidf_matrix_desc * WEIGHT_DESC   # 20% du poids
     ])
     
+    # Garde-fou dtype : les deux blocs sortent en float32 des vectorizers et
+    # les scalaires de pondération ne doivent pas re-promouvoir en float64
+    # (doublerait les octets déplacés par le produit de similarité).
+    if combined_matrix.dtype != np.float32:
+        combined_matrix = combined_matrix.astype(np.float32)
+
     log(f"📐 Matrice combinée finale: {combined_matrix.shape}")
     
-    # 7. Calcul de la similarité cosinus
-    log("🔢 Calcul de la matrice de similarité...")
-    similarity_matrix = linear_kernel(combined_matrix, combined_matrix)
+    # 7. Calcul de la similarité cosinus + sélection des candidats, par tuiles
+    log("🔢 Calcul de la similarité et sélection des candidats (par tuiles)...")
+    # La matrice NxN n'est jamais conservée : la sortie du job est O(N·K),
+    # donc chaque tuile de 512 lignes est densifiée, passée à l'argpartition
+    # batché (axis=1), et seuls les pools de candidats (indices + scores,
+    # ~100 par anime) survivent à la tuile. Le pic mémoire passe de O(N²)
+    # à O(512·N) + O(N·K).
+    # On prend 10x plus de candidats que top_k pour compenser le filtrage
+    # anti-doublons strict (l'anime lui-même est inclus puis écarté).
+    n_animes = combined_matrix.shape[0]
+    pool_size = min(top_k * 10, n_animes - 1)
+    cand_idx = np.empty((n_animes, pool_size + 1), dtype=np.int32)
+    cand_scores = np.empty((n_animes, pool_size + 1), dtype=np.float32)
+    tile_size = 512
+    for tile_start in range(0, n_animes, tile_size):
+        tile_stop = min(tile_start + tile_size, n_animes)
+        block = linear_kernel(combined_matrix[tile_start:tile_stop], combined_matrix)
+        part = np.argpartition(-block, pool_size, axis=1)[:, :pool_size + 1]
+        rows = np.arange(block.shape[0])[:, None]
+        pool = block[rows, part]
+        order = np.argsort(-pool, axis=1)
+        cand_idx[tile_start:tile_stop] = np.take_along_axis(part, order, axis=1)
+        cand_scores[tile_start:tile_stop] = np.take_along_axis(pool, order, axis=1)
     
     # 8. Génération des recommandations
     log("💾 Génération de la table des recommandations (format Parquet)...")
     
-    # Au lieu d'un dictionnaire, on crée une liste de tuples pour un DataFrame plat
-    reco_list = []  # (source_title, reco_title, score)
-    
-    for idx, row in df_final.iterrows():
-        title = row['title']
-        
-        # Récupérer les scores de similarité
-        sim_scores = list(enumerate(similarity_matrix[idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-        
-        # Exclure l'anime lui-même et prendre beaucoup plus de candidats
-        # pour avoir assez de diversité après le filtrage anti-doublons
-        sim_scores = sim_scores[1:top_k*10]  # On prend 10x plus de candidats pour compenser le filtrage strict
-        
-        # 🚫 Filtrage anti-doublons robuste (franchises)
+    # Colonnes accumulées sous forme d'indices entiers : les titres ne sont
+    # jamais dupliqués en Python, chaque ligne ne porte que deux int32 + un
+    # float. L'encodage dictionnaire Arrow les résout à l'écriture.
+    src_indices = []   # Index de l'anime source
+    reco_indices = []  # Index de l'anime recommandé
+    reco_scores = []   # Score de similarité
+
+    # Pré-calcul des franchises et titres normalisés : extract_franchise_name
+    # (14 regex) et .lower() étaient ré-exécutés pour chaque candidat de chaque
+    # anime, soit O(N²) appels ; une passe suffit.
+    titles = df_final['title'].tolist()
+    titles_lower = [t.lower() for t in titles]
+    franchises = [extract_franchise_name(t) for t in titles]
+    # Codes entiers par franchise : permet la dédup vectorisée NumPy ci-dessous
+    franchise_codes, _ = pd.factorize(np.asarray(franchises, dtype=object))
+
+    # Itération sur l'index entier : iterrows() construisait une Series pandas
+    # par ligne alors que seul le titre (déjà extrait en liste) est utilisé.
+    for idx in range(n_animes):
+        # Pool de candidats pré-trié par score (calculé dans la passe tuilée)
+        cands = cand_idx[idx]
+        scores = cand_scores[idx]
+        keep = cands != idx  # Exclure l'anime lui-même
+        cands, scores = cands[keep], scores[keep]
+
+        # 🚫 Dédup franchise vectorisée : np.unique sur les codes garde la
+        # première occurrence (donc le meilleur score) de chaque franchise,
+        # et on écarte d'emblée la franchise de l'anime source. Il ne reste
+        # au Python que les vérifications de sous-chaînes croisées.
+        codes = franchise_codes[cands]
+        _, first_idx = np.unique(codes, return_index=True)
+        first_idx = np.sort(first_idx)
+        cands, scores = cands[first_idx], scores[first_idx]
+        keep = franchise_codes[cands] != franchise_codes[idx]
+        cands, scores = cands[keep], scores[keep]
+
         recommendations_count = 0
-        seen_franchises = set()
-        
-        # Extraire le nom de franchise de l'anime source
-        source_franchise = extract_franchise_name(title)
-        seen_franchises.add(source_franchise)
-        
-        for sim_idx, score in sim_scores:
-            candidate_title = df_final.iloc[sim_idx]['title']
-            candidate_franchise = extract_franchise_name(candidate_title)
-            
-            # Vérifier si cette franchise a déjà été vue
-            if candidate_franchise in seen_franchises:
-                continue
-            
+        source_franchise = franchises[idx]
+
+        for sim_idx, score in zip(cands, scores):
+            candidate_franchise = franchises[sim_idx]
+
             # Vérification supplémentaire: détecter si le nom source est DANS le candidat
             # Ex: "Naruto" est dans "Boruto: Naruto Next Generations"
-            if source_franchise in candidate_title.lower() or candidate_franchise in title.lower():
+            if source_franchise in titles_lower[sim_idx] or candidate_franchise in titles_lower[idx]:
                 continue
-            
-            # Ajouter au format DataFrame (tuple)
-            reco_list.append((title, candidate_title, round(float(score), 3)))
-            seen_franchises.add(candidate_franchise)
+
+            # Ajouter la ligne sous forme d'indices (titres résolus à l'écriture)
+            src_indices.append(idx)
+            reco_indices.append(int(sim_idx))
+            reco_scores.append(float(score))
             recommendations_count += 1
-            
+
             if recommendations_count >= top_k:
                 break
         
         # Log progression tous les 1000 animes
         if (idx + 1) % 1000 == 0:
-            log(f"   📊 {idx + 1}/{len(df_final)} animes traités...")
-    
-    # 9. Convertir la liste en DataFrame
-    log("📊 Conversion en DataFrame...")
-    df_recos = pd.DataFrame(reco_list, columns=['source_title', 'reco_title', 'score'])
+            log(f"   📊 {idx + 1}/{n_animes} animes traités...")
     
-# 10. Sauvegarde au format Parquet optimisé
-    log("💾 Sauvegarde au format Parquet optimisé...")
-    output_file = "data/recommendations.parquet"  # <--- Changer le nom
+    # 9. Construction colonnaire Arrow (zéro DataFrame intermédiaire)
+    log("📊 Construction de la table Arrow...")
+    src = np.asarray(src_indices, dtype=np.int32)
+    rec = np.asarray(reco_indices, dtype=np.int32)
+    scr = np.round(np.asarray(reco_scores, dtype=np.float32), 3)
+
+    # Tri par titre source (ordre lexicographique) puis score décroissant :
+    # les lignes d'un même anime sont contiguës dans le fichier et les
+    # statistiques min/max des row groups deviennent sélectives pour les
+    # lectures filtrées par titre.
+    title_rank = np.empty(n_animes, dtype=np.int32)
+    title_rank[np.argsort(np.asarray(titles, dtype=object))] = np.arange(n_animes)
+    order = np.lexsort((-scr, title_rank[src]))
+    src, rec, scr = src[order], rec[order], scr[order]
+
+    # DictionaryArray : chaque titre n'est écrit qu'une fois dans le fichier,
+    # les lignes ne stockent que des codes int32
+    titles_arrow = pa.array(titles, type=pa.string())
+    table = pa.Table.from_arrays(
+        [
+            pa.DictionaryArray.from_arrays(pa.array(src), titles_arrow),
+            pa.DictionaryArray.from_arrays(pa.array(rec), titles_arrow),
+            pa.array(scr),
+        ],
+        names=['source_title', 'reco_title', 'score'],
+    )
+
+    # 10. Sauvegarde au format Parquet optimisé
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     log(f"📦 Sauvegarde au format Parquet : {output_file}...")
 
-    df_recos.to_parquet(output_file, index=False)
+    # zstd compresse ~20-40% mieux que le snappy par défaut : moins d'octets
+    # à uploader vers GitHub et à télécharger au cold start Streamlit.
+    # L'encodage dictionnaire est très efficace sur les titres répétés, et les
+    # statistiques écrites permettent le pruning de row groups côté lecture.
+    pq.write_table(
+        table,
+        output_file,
+        compression='zstd',
+        compression_level=3,
+        use_dictionary=True,
+        row_group_size=64_000,  # Plusieurs row groups => pruning par statistiques possible
+        data_page_size=1 << 20,
+        write_statistics=True,
+    )
 
     log("✅ Fichier Parquet sauvegardé avec succès !")
 
     # 11. Calcul des métadonnées pour Dagster
-    # total_animes = df_recos['source_title'].nunique()
-    # total_recommendations = len(df_recos)
-    # avg_recommendations = total_recommendations / total_animes if total_animes > 0 else 0
-    file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
-
-    total_animes = df_recos['source_title'].nunique()
-    total_recommendations = len(df_recos)
+    total_animes = int(len(np.unique(src)))
+    total_recommendations = len(src)
     avg_recommendations = total_recommendations / total_animes if total_animes > 0 else 0
     file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
     
     metadata = {
         "total_animes": total_animes,
         "total_recommendations": total_recommendations,
+        "duration_seconds": round(time.perf_counter() - t0, 2),
         "avg_recommendations_per_anime": round(avg_recommendations, 2),
         "combined_matrix_shape": f"{combined_matrix.shape[0]} x {combined_matrix.shape[1]}",
         "meta_matrix_shape": f"{tfidf_matrix_meta.shape[0]} x {tfidf_matrix_meta.shape[1]}",
@@ -3,7 +3,19 @@ import logging
 from dotenv import load_dotenv
 
 # 1. Charger les variables d'env une bonne fois pour toutes
-load_dotenv()
+def load_env_once():
+    """
+    Parse le fichier .env une seule fois par process.
+
+    Le sentinel vit dans os.environ (et non dans une variable de module) car
+    Dagster dev recharge les modules : un flag module serait réinitialisé et
+    le .env serait re-parsé (I/O fichier) à chaque materialization.
+    """
+    if not os.environ.get("ANIME_PLATFORM_ENV_LOADED"):
+        load_dotenv()
+        os.environ["ANIME_PLATFORM_ENV_LOADED"] = "1"
+
+load_env_once()
 
 ANILIST_API_URL = os.getenv("ANILIST_API_URL")
 
@@ -2,6 +2,8 @@
 Helpers pour notebooks Jupyter
 Fournit des fonctions de chargement de données et utilitaires d'analyse
 """
+from functools import lru_cache
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -12,11 +14,35 @@ from config import DB_PARAMS, logger
 plt.style.use('seaborn-v0_8-darkgrid')
 sns.set_palette("husl")
 
+@lru_cache(maxsize=1)
 def get_engine():
-    """Créer une connexion à la base de données PostgreSQL"""
+    """
+    Créer une connexion à la base de données PostgreSQL.
+
+    Mise en cache : les cellules de notebook rappellent souvent les loaders
+    sans passer d'engine, et chaque create_engine repart avec un pool vide
+    (reconnexion ~100-300ms). Un seul moteur partagé garde le pool chaud.
+    """
     DB_URL = f"postgresql://{DB_PARAMS['user']}:{DB_PARAMS['password']}@{DB_PARAMS['host']}/{DB_PARAMS['dbname']}"
     return create_engine(DB_URL)
 
+def _read_view(query, engine):
+    """
+    Lit une vue par chunks de 50k lignes via un curseur serveur
+    (stream_results) : les lignes arrivent au fil de l'eau au lieu d'être
+    toutes matérialisées en objets Python avant la construction du DataFrame,
+    ce qui divise le pic mémoire sur les vues larges.
+    """
+    # dtype_backend : les entiers nullables (score, episodes...) sortent
+    # directement en Int64, sans repasse .astype() colonne par colonne.
+    chunks = pd.read_sql(
+        query,
+        engine.execution_options(stream_results=True),
+        chunksize=50_000,
+        dtype_backend="numpy_nullable",
+    )
+    return pd.concat(chunks, ignore_index=True, copy=False)
+
 def load_anime_data(engine=None):
     """
     Charge les données d'animes depuis view_anime_basic
@@ -27,13 +53,8 @@ def load_anime_data(engine=None):
     if engine is None:
         engine = get_engine()
     
-    df = pd.read_sql("SELECT * FROM view_anime_basic", engine)
-    
-    # Conversion des types
-    df['score'] = df['score'].astype('Int64')
-    df['episodes'] = df['episodes'].astype('Int64')
-    df['start_year'] = df['start_year'].astype('Int64')
-    
+    df = _read_view("SELECT * FROM view_anime_basic", engine)
+
     logger.info(f"📚 Animes chargés : {df.shape[0]} lignes, {df.shape[1]} colonnes")
     return df
 
@@ -47,7 +68,7 @@ def load_genres_data(engine=None):
     if engine is None:
         engine = get_engine()
     
-    df = pd.read_sql("SELECT * FROM view_anime_genres", engine)
+    df = _read_view("SELECT * FROM view_anime_genres", engine)
     logger.info(f"🏷️ Genres chargés : {df.shape[0]} lignes")
     return df
 
@@ -61,7 +82,7 @@ def load_studios_data(engine=None):
     if engine is None:
         engine = get_engine()
     
-    df = pd.read_sql("SELECT * FROM view_anime_studios", engine)
+    df = _read_view("SELECT * FROM view_anime_studios", engine)
     logger.info(f"🎬 Studios chargés : {df.shape[0]} lignes")
     return df
 
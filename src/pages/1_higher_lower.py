@@ -24,25 +24,42 @@ logger.info("🎮 Chargement de la page Higher or Lower")
 # CHARGEMENT DES DONNÉES
 # ============================================================================
 
+@st.cache_resource
+def get_db_engine():
+    """
+    Moteur SQLAlchemy partagé entre les reruns Streamlit : le pool de
+    connexions reste chaud au lieu de repayer le handshake TCP+SSL
+    (~100-300ms) à chaque invalidation du cache de données.
+    """
+    db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    return sqlalchemy.create_engine(
+        db_url,
+        pool_pre_ping=True,
+        pool_size=5,
+        connect_args={"sslmode": "require"},
+    )
+
+
 @st.cache_data
 def load_game_data(top_k=500):
     """Charge les animes populaires pour le jeu."""
     logger.info(f"📊 Chargement des {top_k} animes les plus populaires pour le jeu")
-    db_url = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASS')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}?sslmode=require"
-    engine = sqlalchemy.create_engine(db_url)
-    
-    query = f"""
+    engine = get_db_engine()
+
+    # LIMIT lié en paramètre (pas d'f-string) : le serveur réutilise le même
+    # plan préparé quelle que soit la valeur de top_k.
+    query = sqlalchemy.text("""
     SELECT title, score, cover_image
-    FROM view_anime_basic 
-    WHERE score > 0 
-      AND score IS NOT NULL 
+    FROM view_anime_basic
+    WHERE score > 0
+      AND score IS NOT NULL
       AND popularity IS NOT NULL
       AND cover_image IS NOT NULL
     ORDER BY popularity DESC
-    LIMIT {top_k};
-    """
-    
-    df = pd.read_sql(query, engine)
+    LIMIT :top_k;
+    """)
+
+    df = pd.read_sql(query, engine, params={"top_k": top_k})
     df = df.drop_duplicates(subset=['title']).reset_index(drop=True)
     logger.info(f"✅ {len(df)} animes chargés pour le jeu")
     return df
@@ -102,17 +119,16 @@ def check_answer(guess_is_higher):
 # COMPOSANTS UI
 # ============================================================================
 
+@st.cache_resource
+def _read_css(file_name):
+    """Lit un fichier CSS une seule fois (Streamlit rerun à chaque interaction)."""
+    return (Path(__file__).parent.parent / "styles" / file_name).read_text()
+
+
 def load_css():
-    """Charge le fichier CSS externe."""
-    # Global styles
-    global_css = Path(__file__).parent.parent / "styles" / "global_styles.css"
-    with open(global_css) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-    
-    # Higher or Lower styles
-    css_file = Path(__file__).parent.parent / "styles" / "higher_lower_styles.css"
-    with open(css_file) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    """Injecte les fichiers CSS externes (contenus mis en cache)."""
+    st.markdown(f"<style>{_read_css('global_styles.css')}</style>", unsafe_allow_html=True)
+    st.markdown(f"<style>{_read_css('higher_lower_styles.css')}</style>", unsafe_allow_html=True)
 
 
 def render_header():
@@ -1,7 +1,12 @@
 # src/pages/2_anime_recommender.py (Version optimisée avec Parquet)
 import streamlit as st
 import pandas as pd
+import pyarrow.parquet as pq
+import hashlib
 import os
+import fcntl
+import tempfile
+import requests
 from pathlib import Path
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -15,23 +20,117 @@ logger.info("🎯 Chargement de la page Anime Recommender")
 PARQUET_URL = "https://github.com/YasserMourabih/anime-data-platform/releases/download/v1.0.0-data/recommendations.parquet"
 
 # --- LOAD CSS ---
+@st.cache_resource
+def _read_css(file_name):
+    """Lit un fichier CSS une seule fois (Streamlit rerun à chaque interaction)."""
+    return (Path(__file__).parent.parent / "styles" / file_name).read_text()
+
 def load_css(file_name):
-    """Charge un fichier CSS externe."""
-    css_file = Path(__file__).parent.parent / "styles" / file_name
-    with open(css_file) as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+    """Injecte un fichier CSS externe (contenu mis en cache)."""
+    st.markdown(f"<style>{_read_css(file_name)}</style>", unsafe_allow_html=True)
 
 load_css("global_styles.css")
 load_css("recommender_styles.css")
 
-@st.cache_data
+# Cache disque local du Parquet (module-level : le bouton "Recharger" de la
+# sidebar doit pouvoir le supprimer pour forcer un re-téléchargement).
+CACHE_PATH = Path(tempfile.gettempdir()) / "anime_recos.parquet"
+
+def _sha256_of_file(path: Path) -> str:
+    """Calcule le SHA-256 d'un fichier par lectures de 1 MiB (RAM constante)."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _cache_is_fresh() -> bool:
+    """
+    Compare le SHA-256 du cache local au sidecar .sha256 publié par le
+    déploiement hebdomadaire : le pipeline redéploie un nouveau Parquet sous
+    la même URL, le cache doit donc être invalidé quand le hash change.
+    Si le sidecar est injoignable, on garde le cache (mieux vaut des recos
+    légèrement datées qu'une page cassée).
+    """
+    try:
+        r = requests.get(f"{PARQUET_URL}.sha256", timeout=10)
+        r.raise_for_status()
+        return r.text.strip() == _sha256_of_file(CACHE_PATH)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"⚠️ Sidecar SHA-256 injoignable, cache local conservé : {e}")
+        return True
+
+def get_local_parquet() -> Path:
+    """
+    Télécharge le Parquet de la release vers un cache disque local : les
+    chargements suivants relisent le fichier local au lieu de re-télécharger
+    des dizaines de Mo depuis GitHub. La fraîcheur est vérifiée à chaque
+    (re)chargement via le sidecar SHA-256 — quelques octets sur le réseau.
+    """
+    if CACHE_PATH.exists() and _cache_is_fresh():
+        return CACHE_PATH
+
+    # flock : si plusieurs workers Streamlit démarrent en même temps, un seul
+    # télécharge, les autres attendent puis trouvent le fichier prêt.
+    lock_path = CACHE_PATH.with_suffix(".lock")
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Re-vérifier après l'attente du lock : un autre worker a pu
+            # re-télécharger le fichier frais pendant ce temps.
+            if CACHE_PATH.exists() and _cache_is_fresh():
+                return CACHE_PATH
+            logger.info(f"⬇️ Téléchargement du Parquet vers le cache local : {CACHE_PATH}")
+            tmp_path = CACHE_PATH.with_suffix(".tmp")
+            with requests.get(PARQUET_URL, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+            tmp_path.rename(CACHE_PATH)  # Rename atomique : jamais de fichier partiel
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return CACHE_PATH
+
+# cache_resource (et non cache_data) : cache_data re-désérialise sa valeur à
+# CHAQUE rerun, soit ~5000 DataFrames à reconstruire par interaction widget.
+# L'index est servi par référence partagée — il ne doit jamais être muté.
+@st.cache_resource
 def load_recommendations():
     """Charge les recommandations depuis le fichier Parquet (ultra-rapide)."""
     logger.info(f"📂 Chargement des recommandations depuis {PARQUET_URL}")
-    df_recos = pd.read_parquet(PARQUET_URL)
-    all_titles = sorted(df_recos['source_title'].unique())
-    logger.info(f"✅ {len(all_titles)} animes et {len(df_recos)} recommandations chargées")
-    return df_recos, all_titles
+    # memory_map=True : le fichier (déjà en cache disque local) est mappé au
+    # lieu d'être copié dans le heap, et seules les colonnes utilisées par la
+    # page sont lues. self_destruct libère les buffers Arrow au fil de la
+    # conversion pandas pour éviter un double pic mémoire.
+    tbl = pq.read_table(
+        get_local_parquet(),
+        memory_map=True,
+        columns=['source_title', 'reco_title', 'score'],
+    )
+    df_recos = tbl.to_pandas(self_destruct=True)
+
+    # Titres en dtype category : chaque titre n'est stocké qu'une fois et les
+    # lignes ne portent que des codes entiers (~5-10x moins de RAM que des
+    # chaînes object répétées des milliers de fois).
+    df_recos['source_title'] = df_recos['source_title'].astype('category')
+    df_recos['reco_title'] = df_recos['reco_title'].astype('category')
+
+    # Index par anime source, pré-trié par score : chaque clic devient un
+    # lookup dict O(1) au lieu de deux scans booléens complets du DataFrame.
+    df_recos = df_recos.sort_values('score', ascending=False)
+    groups = {
+        title: group
+        for title, group in df_recos.groupby('source_title', sort=False, observed=True)
+    }
+    # Les titres viennent des groupes (pas des catégories) : le dictionnaire
+    # Parquet couvre tout le vocabulaire en ordre de popularité, y compris des
+    # titres sans aucune ligne de recommandation — seuls les titres réellement
+    # présents sont proposés, triés alphabétiquement pour la selectbox.
+    all_titles = sorted(groups)
+    total_recos = len(df_recos)
+    logger.info(f"✅ {len(all_titles)} animes et {total_recos} recommandations chargées")
+    return groups, all_titles, total_recos
 
 # --- HEADER ---
 st.markdown("""
@@ -47,45 +146,54 @@ st.markdown("""
 st.markdown('<p class="subtitle">Trouve des animes similaires à tes coups de cœur</p>', unsafe_allow_html=True)
 
 try:
-    df_recos, all_titles = load_recommendations()
-    
-    st.info(f"{len(all_titles):,} animes disponibles | {len(df_recos):,} recommandations pré-calculées")
-    
+    groups, all_titles, total_recos = load_recommendations()
+
+    st.info(f"{len(all_titles):,} animes disponibles | {total_recos:,} recommandations pré-calculées")
+
     selected_anime = st.selectbox("Tu as aimé", all_titles, index=None, placeholder="Choisis un anime...")
-    
+
     # Afficher le nombre de recommandations disponibles
     if selected_anime:
-        nb_recos = len(df_recos[df_recos['source_title'] == selected_anime])
+        nb_recos = len(groups[selected_anime])
         st.caption(f"{nb_recos} recommandations disponibles pour cet anime")
 
     if st.button("Trouver des recommandations", type="primary", use_container_width=True):
         if selected_anime:
             logger.info(f"🔍 Recherche de recommandations pour '{selected_anime}'")
-            # Filtre Pandas ultra-rapide
-            recommendations = df_recos[df_recos['source_title'] == selected_anime].sort_values('score', ascending=False)
+            # Lookup O(1) : le groupe est déjà trié par score décroissant
+            recommendations = groups[selected_anime]
             
             if not recommendations.empty:
                 logger.info(f"✅ {len(recommendations)} recommandations trouvées pour '{selected_anime}'")
                 st.success(f"Recommandations pour **{selected_anime}** ({len(recommendations)} trouvées)")
-                
-                # Afficher les top 10
-                for i, row in enumerate(recommendations.head(10).itertuples(), 1):
-                    col1, col2 = st.columns([4, 1])
-                    with col1:
-                        st.markdown(f"**{i}. {row.reco_title}**")
-                    with col2:
-                        st.markdown(f'<span class="score-badge">{int(row.score*100)}%</span>', unsafe_allow_html=True)
-                    st.progress(row.score)
-                
+
+                # Un seul st.dataframe au lieu de ~5 widgets par ligne : une
+                # seule frame websocket vers le frontend au lieu de dizaines.
+                df_display = recommendations[['reco_title', 'score']].reset_index(drop=True)
+                df_display.index = df_display.index + 1  # Rang à partir de 1
+                reco_columns = {
+                    'reco_title': st.column_config.TextColumn("Anime"),
+                    'score': st.column_config.ProgressColumn(
+                        # format="percent" : le score 0-1 est affiché en %
+                        # (un printf "%.0f%%" rendrait "0%" ou "1%")
+                        "Score", min_value=0.0, max_value=1.0, format="percent"
+                    ),
+                }
+
+                st.dataframe(
+                    df_display.head(10),
+                    column_config=reco_columns,
+                    use_container_width=True,
+                )
+
                 # Option pour voir plus de recommandations
-                if len(recommendations) > 10:
-                    with st.expander(f"Voir toutes les {len(recommendations)} recommandations"):
-                        for i, row in enumerate(recommendations.iloc[10:].itertuples(), 11):
-                            col1, col2 = st.columns([4, 1])
-                            with col1:
-                                st.write(f"**{i}. {row.reco_title}**")
-                            with col2:
-                                st.write(f"{int(row.score*100)}%")
+                if len(df_display) > 10:
+                    with st.expander(f"Voir toutes les {len(df_display)} recommandations"):
+                        st.dataframe(
+                            df_display.iloc[10:],
+                            column_config=reco_columns,
+                            use_container_width=True,
+                        )
             else:
                 logger.warning(f"⚠️ Aucune recommandation trouvée pour '{selected_anime}'")
                 st.warning(f"Aucune recommandation trouvée pour **{selected_anime}**")
@@ -124,7 +232,9 @@ with st.sidebar:
     # Actions
     if st.button("Recharger les données", key="sidebar_reload_btn"):
         logger.info("🔄 Rechargement des données (cache vidé)")
+        CACHE_PATH.unlink(missing_ok=True)  # Force le re-téléchargement du Parquet
         st.cache_data.clear()
+        st.cache_resource.clear()  # L'index des recommandations vit ici
         st.rerun()
     
     st.markdown("---")
@@ -8,6 +8,7 @@ query ($page: Int, $perPage: Int) {
   Page(page: $page, perPage: $perPage) {
     pageInfo {
       hasNextPage
+      lastPage
     }
     media(type: ANIME, sort: POPULARITY_DESC) {
       id
@@ -64,10 +65,26 @@ query ($page: Int, $perPage: Int) {
 '''
 
 # --- SQL Queries ---
-ANILIST_UPSERT_ANIME = """
+# Ingestion via COPY : les lignes arrivent par le protocole COPY (bien plus
+# rapide qu'un INSERT ... VALUES multi-lignes) dans une table temporaire,
+# puis un seul upsert ensembliste alimente raw_anilist_json.
+ANILIST_CREATE_STAGING = """
+CREATE TEMP TABLE stg_anilist_json (
+    anime_id INT,
+    raw_data JSONB
+) ON COMMIT DROP;
+"""
+
+ANILIST_COPY_STAGING = "COPY stg_anilist_json (anime_id, raw_data) FROM STDIN"
+
+# DISTINCT ON : si deux pages fetchées en parallèle se chevauchent (le tri
+# par popularité AniList peut bouger entre deux requêtes), l'upsert ne doit
+# pas toucher deux fois la même ligne dans la même commande.
+ANILIST_UPSERT_FROM_STAGING = """
 INSERT INTO raw_anilist_json (anime_id, raw_data)
-VALUES %s
-ON CONFLICT (anime_id) DO UPDATE 
+SELECT DISTINCT ON (anime_id) anime_id, raw_data
+FROM stg_anilist_json
+ON CONFLICT (anime_id) DO UPDATE
 SET raw_data = EXCLUDED.raw_data,
     fetched_at = CURRENT_TIMESTAMP;
 """
\ No newline at end of file